@@ -1,13 +1,24 @@
 #!/usr/bin/env python3
 
+import copy
 import csv
 import glob
+import json
 import operator
 import os
+import re
 import shutil
 import sys
+import tempfile
+import time
 from abc import ABC
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 class SourcePort(ABC):
@@ -24,11 +35,18 @@ class SourcePort(ABC):
         self.version = version
         self.doom_config = doom_config
         self.configurations = ['music', 'nomusic', 'nomonsters']
+        self.demo_formats = ['vanilla']
         self.misc_config = misc_config
 
     def get_configurations(self):
         return self.configurations
 
+    def get_benchmark_configurations(self):
+        return ['nomusic']
+
+    def can_play_demo(self, demo_format):
+        return demo_format in self.demo_formats
+
     def get_playdemo_batch_commands(self, game, demo_path):
         commands = []
         [commands.append(x) for x in self.get_pre_launch_config_commands(None)]
@@ -42,6 +60,13 @@ class SourcePort(ABC):
         [commands.append(x) for x in self.get_post_game_config_commands(game, 'viddump')]
         return commands
 
+    def get_benchmark_batch_commands(self, game, win_demo_path, configuration, log_path):
+        commands = []
+        [commands.append(x) for x in self.get_pre_launch_config_commands('benchmark')]
+        commands.append(self._get_timedemo_command(game, win_demo_path, configuration, log_path))
+        [commands.append(x) for x in self.get_post_game_config_commands(game, 'benchmark')]
+        return commands
+
     def get_launch_batch_commands(self, game, configuration):
         commands = []
         [commands.append(x) for x in self.get_pre_launch_config_commands(configuration)]
@@ -133,6 +158,9 @@ class SourcePort(ABC):
             options += '-nomonsters '
         return options
 
+    def get_benchmark_misc_options(self, game):
+        return '-fullscreen -nomusic '
+
     def get_skill_option(self):
         return '-skill 4 '
 
@@ -145,6 +173,9 @@ class SourcePort(ABC):
             return '-warp {0} {1} '.format(episode.number, mission.number)
         raise ValueError('iwad {0} not supported yet'.format(game.iwad))
 
+    def get_timedemo_log_option(self, log_path):
+        return '> "{0}" 2>&1'.format(log_path)
+
     def get_low_priority_wads(self, game):
         options = ''
         # Some WADs aren't compatible with the sprite fix WAD
@@ -187,6 +218,17 @@ class SourcePort(ABC):
         launch_command += ' -viddump "{0}"'.format(path)
         return launch_command.strip()
 
+    def _get_timedemo_command(self, game, win_demo_path, configuration, log_path):
+        launch_command = '{0} '.format(self.exe_name)
+        launch_command += self.get_game_options(game, None, None)
+        mod_options = self.get_mod_options(configuration)
+        if mod_options:
+            launch_command += mod_options
+        launch_command += self.get_benchmark_misc_options(game)
+        launch_command += '-timedemo "{0}" '.format(win_demo_path)
+        launch_command += self.get_timedemo_log_option(log_path)
+        return launch_command.strip()
+
     def _get_pre_launch_record_commands(self, game, mission=None):
         commands = []
         commands.append(
@@ -264,6 +306,10 @@ class BoomSourcePort(SourcePort):
             options += '-nomusic '
         return options
 
+    def get_benchmark_misc_options(self, game):
+        # No -complevel, so the port works out the compatibility level from the demo itself.
+        return '-nowindow -noaccel -nomusic '
+
 
 class DsdaSourcePort(BoomSourcePort):
     def __init__(self, install_path, version, doom_config):
@@ -272,6 +318,7 @@ class DsdaSourcePort(BoomSourcePort):
             'dsda-doom.exe', install_path, version, doom_config,
             MiscConfig(use_single_file_arg=True, use_config_arg=True))
         self.configurations = ['music', 'nomusic', 'nomonsters', 'record']
+        self.demo_formats = ['vanilla', 'boom', 'mbf21']
 
     def _get_pre_launch_record_commands(self, game, mission):
         commands = []
@@ -333,6 +380,7 @@ class PrBoomSourcePort(BoomSourcePort):
             self, 'prboom', 'PRBoom-plus', 'prboom-plus.cfg',
             'prboom-plus.exe', install_path, version, doom_config,
             MiscConfig(use_single_file_arg=True, use_config_arg=True))
+        self.demo_formats = ['vanilla', 'boom']
 
 
 class GlBoomSourcePort(BoomSourcePort):
@@ -342,6 +390,7 @@ class GlBoomSourcePort(BoomSourcePort):
             'glboom-plus.exe', install_path, version, doom_config,
             MiscConfig(use_single_file_arg=True, use_config_arg=True))
         self.configurations = ['music', 'nomusic', 'nomonsters', 'record']
+        self.demo_formats = ['vanilla', 'boom']
 
     def get_recording_options(self, game, episode, mission):
         return '-record MAP{0}-%datetime%.lmp '.format(str(mission.level).zfill(2))
@@ -370,6 +419,13 @@ class GzDoomSourcePort(SourcePort):
             MiscConfig(use_single_file_arg=False, use_config_arg=True))
         self.configurations = [
             'music', 'nomusic', 'smooth', 'beautiful', 'nomonsters', 'record']
+        self.demo_formats = ['zdoom']
+
+    def get_benchmark_configurations(self):
+        return ['nomusic', 'smooth', 'beautiful']
+
+    def get_timedemo_log_option(self, log_path):
+        return '+logfile "{0}"'.format(log_path)
 
     def get_mod_options(self, configuration):
         options = ''
@@ -406,6 +462,10 @@ class ZDoomSourcePort(SourcePort):
             self, 'zdoom', 'ZDoom', 'zdoom-Chris.ini',
             'zdoom.exe', install_path, version, doom_config,
             MiscConfig(use_single_file_arg=False, use_config_arg=True))
+        self.demo_formats = ['zdoom']
+
+    def get_timedemo_log_option(self, log_path):
+        return '+logfile "{0}"'.format(log_path)
 
 
 class Game(object):
@@ -439,6 +499,9 @@ class Game(object):
         d2all_path = os.path.join(game_demo_path, 'D2All')
         if not os.path.exists(d2all_path):
             os.makedirs(d2all_path)
+        benchmark_path = os.path.join(game_demo_path, 'benchmark')
+        if not os.path.exists(benchmark_path):
+            os.makedirs(benchmark_path)
 
     def create_save_directories(self):
         saves_path = os.path.join(
@@ -483,6 +546,103 @@ class Game(object):
                 for command in commands:
                     f.write(command + os.linesep)
 
+    def generate_demo_stats(self):
+        if np is None:
+            return
+        full_demo_paths = []
+        for demo_path in self._get_full_demo_paths():
+            if DemoAnalyser.get_demo_format(demo_path) == 'zdoom':
+                print('Skipping {0}: ZDoom demos cannot be analysed'.format(demo_path))
+                continue
+            full_demo_paths.append(demo_path)
+        demo_launchers_path = self._get_demo_launchers_path_for_game()
+        analyser = DemoAnalyser()
+        with ProcessPoolExecutor() as executor:
+            futures = [executor.submit(analyser.analyse, path) for path in full_demo_paths]
+            for demo_path, future in zip(full_demo_paths, futures):
+                try:
+                    stats = future.result()
+                except (ValueError, OSError) as e:
+                    print('Could not analyse {0}: {1}'.format(demo_path, e))
+                    continue
+                path = self._get_demo_launcher_path(demo_launchers_path, demo_path, 'json')
+                with open(path, 'w') as f:
+                    print('Writing {0}'.format(path))
+                    json.dump(stats, f, indent=4)
+
+    def generate_benchmark_batch_file(self):
+        """
+        Generates a single batch file that plays every demo in the game's 'benchmark' demo
+        directory with -timedemo, for each version and benchmark configuration of each
+        source port that can play the demo's format. The timing output of each run is appended
+        to a results file under a '###' line that identifies the run, ready for
+        `generate_benchmark_report`.
+        """
+        benchmark_demos_path = os.path.join(
+            self.doom_config.unix_demos_path, self.get_directory_friendly_name(), 'benchmark')
+        if not os.path.exists(benchmark_demos_path):
+            return
+        demo_paths = sorted(
+            os.path.join(benchmark_demos_path, x)
+            for x in os.listdir(benchmark_demos_path) if x.endswith('lmp'))
+        if not demo_paths:
+            return
+        win_demos_path = self._get_win_demos_path_for_game()
+        results_path = '{0}\\{1}'.format(
+            self.doom_config.benchmark_results_path, self.get_directory_friendly_name())
+        results_file_path = '{0}\\results.txt'.format(results_path)
+        log_path = '{0}\\timedemo.log'.format(results_path)
+        commands = []
+        commands.append('@echo off')
+        commands.append('if not exist "{0}\\" mkdir "{1}"'.format(results_path, results_path))
+        commands.append('if exist "{0}" del "{1}"'.format(results_file_path, results_file_path))
+        demo_formats = {x: DemoAnalyser.get_demo_format(x) for x in demo_paths}
+        for source_port in self.source_ports:
+            for config in source_port.get_benchmark_configurations():
+                for demo_path in demo_paths:
+                    if not source_port.can_play_demo(demo_formats[demo_path]):
+                        continue
+                    win_demo_path = self._get_win_demo_path(demo_path, win_demos_path)
+                    commands.append('echo ### {0} {1} {2} {3}>> "{4}"'.format(
+                        source_port.name,
+                        source_port.version,
+                        config,
+                        os.path.basename(demo_path),
+                        results_file_path))
+                    commands.append('if exist "{0}" del "{1}"'.format(log_path, log_path))
+                    [commands.append(x) for x in source_port.get_benchmark_batch_commands(
+                        self, win_demo_path, config, log_path)]
+                    commands.append('type "{0}" >> "{1}"'.format(log_path, results_file_path))
+        path = os.path.join(self._get_benchmarks_path_for_game(), 'benchmark.bat')
+        with open(path, 'w') as f:
+            print('Writing {0}'.format(path))
+            for command in commands:
+                f.write(command + os.linesep)
+
+    def generate_benchmark_report(self):
+        results_path = os.path.join(
+            self.doom_config.unix_benchmark_results_path, self.get_directory_friendly_name())
+        results_file_path = os.path.join(results_path, 'results.txt')
+        if not os.path.exists(results_file_path):
+            return
+        # The results are on the Windows drive, so only rewrite the reports for new results.
+        results_mtime = os.path.getmtime(results_file_path)
+        report_paths = [os.path.join(results_path, x) for x in ['results.csv', 'results.json']]
+        if all(os.path.exists(x) and os.path.getmtime(x) >= results_mtime for x in report_paths):
+            return
+        parser = BenchmarkResultsParser(results_file_path)
+        results = parser.parse_results()
+        path = os.path.join(results_path, 'results.csv')
+        with open(path, 'w', newline='') as f:
+            print('Writing {0}'.format(path))
+            writer = csv.DictWriter(f, fieldnames=BenchmarkResultsParser.fields)
+            writer.writeheader()
+            writer.writerows(results)
+        path = os.path.join(results_path, 'results.json')
+        with open(path, 'w') as f:
+            print('Writing {0}'.format(path))
+            json.dump(results, f, indent=4)
+
     def generate_launch_batch_files(self):
         for source_port in self.source_ports:
             for config in source_port.get_configurations():
@@ -561,10 +721,10 @@ class Game(object):
         demo_sub_dir_name = os.path.basename(os.path.dirname(demo_path))
         return '{0}\\{1}\\{2}'.format(win_demos_path, demo_sub_dir_name, demo_file_name)
 
-    def _get_demo_launcher_path(self, demo_launchers_path, demo_path):
+    def _get_demo_launcher_path(self, demo_launchers_path, demo_path, extension='bat'):
         demo_file_name = os.path.basename(demo_path)
         demo_sub_dir_name = os.path.basename(os.path.dirname(demo_path))
-        batch_file_name = '{0}.bat'.format(demo_file_name.split('.')[0])
+        batch_file_name = '{0}.{1}'.format(demo_file_name.split('.')[0], extension)
         path = os.path.join(demo_launchers_path, demo_sub_dir_name, batch_file_name)
         dir_path = os.path.dirname(path)
         if not os.path.exists(dir_path):
@@ -597,6 +757,13 @@ class Game(object):
             os.makedirs(demo_launchers_path)
         return demo_launchers_path
 
+    def _get_benchmarks_path_for_game(self):
+        benchmarks_path = os.path.join(
+            self.doom_config.unix_benchmarks_path, self.get_directory_friendly_name())
+        if not os.path.exists(benchmarks_path):
+            os.makedirs(benchmarks_path)
+        return benchmarks_path
+
     def _get_viddump_launchers_path_for_game(self):
         viddump_launchers_path = os.path.join(
             self.doom_config.unix_viddump_launchers_path, self.get_directory_friendly_name())
@@ -627,6 +794,139 @@ class Mission(object):
         return self.name.replace('/', '').replace('!', '').replace("'", '')
 
 
+class DemoAnalyser(object):
+    """
+    Reads the ticcmd section of an LMP file with NumPy to get the length of a demo and a profile
+    of the player input, without having to play it back in a source port.
+
+    Vanilla demos have a short header with 4 player slots, while Boom and MBF demos have a longer
+    one with options and 32 player slots. Each ticcmd is forward, side, turn and buttons. Longtics
+    demos (versions 111, 214 and 221) store the turn as a 16 bit value; otherwise it's only the
+    high byte. The ticcmds end with a 0x80 marker, which may be followed by a footer. Demos from
+    before version 1.4 have no version byte, so their version is reported as None.
+    """
+    tic_rate = 35
+    end_marker = 0x80
+    fire_button = 0x01
+    use_button = 0x02
+    special_button = 0x80
+    boom_versions = [200, 201, 202, 203, 204, 210, 211, 212, 213, 214]
+    longtics_versions = [111, 214, 221]
+
+    @classmethod
+    def get_demo_format(cls, demo_path):
+        """
+        Works out the demo format from the start of the file, without needing NumPy. ZDoom
+        demos are IFF files that begin with 'FORM'. Returns None for anything unrecognised.
+        """
+        with open(demo_path, 'rb') as f:
+            start = f.read(12)
+        if start[:4] == b'FORM' and start[8:12] == b'ZDEM':
+            return 'zdoom'
+        if not start:
+            return None
+        version = start[0]
+        if version <= 4 or 104 <= version <= 111:
+            return 'vanilla'
+        if version in cls.boom_versions:
+            return 'boom'
+        if version == 221:
+            return 'mbf21'
+        return None
+
+    def analyse(self, demo_path):
+        data = np.fromfile(demo_path, dtype=np.uint8)
+        version, header_size, players, longtics = self._read_header(data)
+        cmd_dtype = np.dtype([
+            ('forward', 'i1'),
+            ('side', 'i1'),
+            ('turn', '<i2' if longtics else 'i1'),
+            ('buttons', 'u1')])
+        tic_size = cmd_dtype.itemsize * len(players)
+        tic_offsets = np.arange(header_size, data.size, tic_size)
+        markers = np.flatnonzero(data[tic_offsets] == self.end_marker)
+        if markers.size:
+            tics = int(markers[0])
+        else:
+            tics = (data.size - header_size) // tic_size
+        cmds = np.frombuffer(
+            data, dtype=cmd_dtype, count=tics * len(players), offset=header_size)
+        cmds = cmds.reshape(tics, len(players))
+        return {
+            'demo': os.path.basename(demo_path),
+            'version': version,
+            'longtics': longtics,
+            'players': len(players),
+            'tics': tics,
+            'duration_seconds': round(tics / self.tic_rate, 2),
+            'end_marker': bool(markers.size),
+            'player_stats': [
+                self._get_player_stats(player, cmds[:, n], longtics)
+                for n, player in enumerate(players)
+            ]
+        }
+
+    def _read_header(self, data):
+        if data.size == 0:
+            raise ValueError('demo is empty')
+        if bytes(data[:4]) == b'FORM':
+            raise ValueError('ZDoom demos are not supported')
+        version = int(data[0])
+        if version <= 4:
+            # Versions before 1.4 had no version byte and started with the skill.
+            header_size, player_slots = 3, 4
+        elif 104 <= version <= 111:
+            header_size, player_slots = 9, 4
+        elif version in self.boom_versions or version == 221:
+            # Version, signature, compatibility, skill, episode, map, deathmatch, console player.
+            header_size, player_slots = 13, 32
+            if version == 221:
+                # MBF21 has 20 option bytes followed by a count of the comp options.
+                if data.size <= header_size + 20:
+                    raise ValueError('header is truncated')
+                header_size += 21 + int(data[header_size + 20])
+            elif version == 200:
+                header_size += 256
+            else:
+                header_size += 64
+        else:
+            raise ValueError('demo version {0} not supported'.format(version))
+        player_bytes = data[header_size:header_size + player_slots]
+        header_size += player_slots
+        if data.size < header_size or np.any(player_bytes > 1) or not np.any(player_bytes):
+            raise ValueError('header for demo version {0} is not valid'.format(version))
+        players = [int(x) for x in np.flatnonzero(player_bytes)]
+        longtics = version in self.longtics_versions
+        if version <= 4:
+            # There's no version to report, the byte was the skill.
+            version = None
+        return version, header_size, players, longtics
+
+    def _get_player_stats(self, player, cmds, longtics):
+        turn = cmds['turn'].astype(np.int32)
+        if not longtics:
+            turn <<= 8
+        buttons = cmds['buttons']
+        normal = (buttons & self.special_button) == 0
+        return {
+            'player': player + 1,
+            'forward': self._get_histogram(cmds['forward']),
+            'strafe': self._get_histogram(cmds['side']),
+            'turn': {
+                'left': int(np.count_nonzero(turn > 0)),
+                'right': int(np.count_nonzero(turn < 0)),
+                'none': int(np.count_nonzero(turn == 0)),
+                'mean_abs': round(float(np.abs(turn).mean()), 2) if turn.size else 0.0
+            },
+            'fire': int(np.count_nonzero(normal & ((buttons & self.fire_button) != 0))),
+            'use': int(np.count_nonzero(normal & ((buttons & self.use_button) != 0)))
+        }
+
+    def _get_histogram(self, values):
+        counts = np.bincount(values.astype(np.int16) + 128, minlength=256)
+        return {str(n - 128): int(counts[n]) for n in np.flatnonzero(counts)}
+
+
 class GameParser(object):
     def __init__(self, csv_path, doom_config):
         self.csv_path = csv_path
@@ -683,6 +983,54 @@ class GameParser(object):
         return episode_boundaries
 
 
+class BenchmarkResultsParser(object):
+    """
+    Parses the results file written by a benchmark batch file. Each run starts with a line in
+    the form '### <port> <version> <configuration> <demo>', followed by whatever the port logged.
+    The Boom family, Crispy and the ZDoom family all report the timing in the form
+    '<n> gametics in <n> realtics', followed by the frame rate. If a run crashed or never
+    reported its timing, its timing fields are left empty.
+    """
+    fields = ['port', 'version', 'configuration', 'demo', 'gametics', 'realtics', 'fps']
+    header_regex = re.compile(r'^### (\S+) (\S+) (\S+) (.+)$')
+    timing_regex = re.compile(r'(\d+) gametics in (\d+) realtics', re.IGNORECASE)
+    fps_regex = re.compile(r'([\d.]+) ?(?:fps|frames per second)', re.IGNORECASE)
+
+    def __init__(self, results_path):
+        self.results_path = results_path
+
+    def parse_results(self):
+        results = []
+        with open(self.results_path, 'r', errors='replace') as f:
+            for line in f:
+                line = line.strip()
+                header_match = self.header_regex.match(line)
+                if header_match:
+                    port, version, configuration, demo = header_match.groups()
+                    results.append({
+                        'port': port,
+                        'version': version,
+                        'configuration': configuration,
+                        'demo': demo,
+                        'gametics': None,
+                        'realtics': None,
+                        'fps': None
+                    })
+                    continue
+                timing_match = self.timing_regex.search(line)
+                if timing_match and results and results[-1]['gametics'] is None:
+                    gametics = int(timing_match.group(1))
+                    realtics = int(timing_match.group(2))
+                    fps_match = self.fps_regex.search(line, timing_match.end())
+                    fps = None
+                    if fps_match:
+                        fps = float(fps_match.group(1))
+                    elif realtics:
+                        fps = round(gametics * DemoAnalyser.tic_rate / realtics, 1)
+                    results[-1].update(gametics=gametics, realtics=realtics, fps=fps)
+        return results
+
+
 class DoomConfig(object):
     def __init__(self, windows_home_directory_path, unix_home_directory_path):
         self.windows_home_directory_path = windows_home_directory_path
@@ -691,6 +1039,9 @@ class DoomConfig(object):
         self.unix_launchers_path = os.path.join(unix_home_directory_path, 'launchers')
         self.unix_demo_launchers_path = os.path.join(unix_home_directory_path, 'demo-launchers')
         self.unix_viddump_launchers_path = os.path.join(unix_home_directory_path, 'viddump-launchers')
+        self.unix_benchmarks_path = os.path.join(unix_home_directory_path, 'benchmarks')
+        self.unix_benchmark_results_path = os.path.join(
+            unix_home_directory_path, 'benchmark-results')
         self.unix_demos_path = os.path.join(unix_home_directory_path, 'demos')
         self.unix_saves_path = os.path.join(unix_home_directory_path, 'saves')
         self.config_path = '{0}\\{1}'.format(self.windows_home_directory_path, 'config')
@@ -703,8 +1054,29 @@ class DoomConfig(object):
         self.demos_path = '{0}\\{1}'.format(self.windows_home_directory_path, 'demos')
         self.saves_path = '{0}\\{1}'.format(self.windows_home_directory_path, 'saves')
         self.viddump_path = '{0}\\{1}'.format(self.windows_home_directory_path, 'viddump')
+        self.benchmark_results_path = '{0}\\{1}'.format(
+            self.windows_home_directory_path, 'benchmark-results')
         self.utils_path = '{0}\\{1}'.format(self.windows_home_directory_path, 'utils')
 
+    def get_output_path_names(self):
+        return [
+            'unix_launchers_path',
+            'unix_demo_launchers_path',
+            'unix_viddump_launchers_path',
+            'unix_benchmarks_path',
+            'unix_saves_path']
+
+    def get_staging_config(self, staging_path):
+        """
+        Returns a copy of this config with all the generated output redirected into the staging
+        directory. Inputs like the demos and source ports are still read from the real tree.
+        """
+        staging_config = copy.copy(self)
+        for name in self.get_output_path_names():
+            relative_path = os.path.relpath(getattr(self, name), self.unix_home_directory_path)
+            setattr(staging_config, name, os.path.join(staging_path, relative_path))
+        return staging_config
+
 
 class MiscConfig(object):
     def __init__(self, use_single_file_arg=True, use_config_arg=True, save_arg_name='save'):
@@ -713,6 +1085,134 @@ class MiscConfig(object):
         self.save_arg_name = save_arg_name
 
 
+SyncResult = namedtuple('SyncResult', ['written', 'unchanged', 'deleted', 'staged_size', 'elapsed'])
+
+
+class TreeSync(object):
+    """
+    Mirrors directory trees generated on a fast native filesystem onto a slow target, like the
+    drvfs mount of the Windows drive. All the trees are compared first, then the differences are
+    applied in one pass: missing directories are created, changed files are copied next to their
+    destination under a temporary name and then renamed into place as a batch, and finally any
+    stale files are deleted.
+
+    Each tree is listed once on each side, so the target only has its contents read when a file
+    has the same size as the staged copy.
+    """
+    temp_suffix = '.sync-tmp'
+    probe_prefix = '.sync-probe-'
+
+    def __init__(self):
+        self.trees = []
+
+    def add_tree(self, source_root, target_root, delete_stale=True, keep_extensions=()):
+        self.trees.append((source_root, target_root, delete_stale, tuple(keep_extensions)))
+
+    def sync(self):
+        start = time.perf_counter()
+        directories, copies, stale, unchanged, staged_size = self._get_changes()
+        for directory in directories:
+            os.makedirs(directory, exist_ok=True)
+        self._copy_and_swap(copies)
+        for path in stale:
+            os.remove(path)
+        return SyncResult(
+            len(copies), unchanged, len(stale), staged_size, time.perf_counter() - start)
+
+    def probe_write_cost(self, directory, size, count=20):
+        """
+        Times writing small files straight into the target directory, the way the launchers are
+        written without staging, and returns the average number of seconds per file.
+        """
+        os.makedirs(directory, exist_ok=True)
+        paths = [
+            os.path.join(directory, '{0}{1}'.format(self.probe_prefix, n)) for n in range(count)
+        ]
+        contents = 'x' * size
+        try:
+            start = time.perf_counter()
+            for path in paths:
+                with open(path, 'w') as f:
+                    f.write(contents)
+            return (time.perf_counter() - start) / count
+        finally:
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _get_changes(self):
+        directories = []
+        copies = []
+        stale = []
+        unchanged = 0
+        staged_size = 0
+        for source_root, target_root, delete_stale, keep_extensions in self.trees:
+            source_root = os.path.normpath(source_root)
+            target_root = os.path.normpath(target_root)
+            source_dirs, source_files = self._scan_tree(source_root)
+            target_dirs, target_files = self._scan_tree(target_root)
+            for source_dir in source_dirs:
+                target_dir = os.path.join(target_root, os.path.relpath(source_dir, source_root))
+                if os.path.normpath(target_dir) not in target_dirs:
+                    directories.append(target_dir)
+            staged_files = set()
+            for source_path, size in source_files.items():
+                target_path = os.path.join(target_root, os.path.relpath(source_path, source_root))
+                staged_files.add(target_path)
+                staged_size += size
+                if target_files.get(target_path) == size and self._has_same_contents(
+                        source_path, target_path):
+                    unchanged += 1
+                else:
+                    copies.append((source_path, target_path))
+            if delete_stale:
+                stale.extend(
+                    x for x in target_files
+                    if x not in staged_files and not x.endswith(keep_extensions))
+        return directories, copies, stale, unchanged, staged_size
+
+    def _scan_tree(self, root):
+        """
+        Returns the set of directories and a map of file paths to sizes under the root, or
+        nothing if the root doesn't exist.
+        """
+        dirs = set()
+        files = {}
+        if not os.path.isdir(root):
+            return dirs, files
+        pending = [root]
+        while pending:
+            directory = pending.pop()
+            dirs.add(directory)
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        pending.append(entry.path)
+                    else:
+                        files[entry.path] = entry.stat().st_size
+        return dirs, files
+
+    def _has_same_contents(self, source_path, target_path):
+        with open(source_path, 'rb') as source, open(target_path, 'rb') as target:
+            return source.read() == target.read()
+
+    def _copy_and_swap(self, copies):
+        temp_paths = []
+        try:
+            for source_path, target_path in copies:
+                temp_path = target_path + self.temp_suffix
+                temp_paths.append(temp_path)
+                shutil.copyfile(source_path, temp_path)
+            for (_, target_path), temp_path in zip(copies, temp_paths):
+                os.replace(temp_path, target_path)
+        except BaseException:
+            # Anything not yet renamed into place is left behind as a temporary file.
+            for temp_path in temp_paths:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            raise
+
+
 class SourcePortBuilder(object):
     def __init__(self, doom_config):
         self.doom_config = doom_config
@@ -826,19 +1326,66 @@ def get_doom_config():
         unix_doom_home_path = os.path.join('/c/Users', windows_username, 'doom')
     return DoomConfig(windows_doom_home_path, unix_doom_home_path)
 
+def sync_staged_output(games, staging_config, doom_config, generate_elapsed):
+    """
+    Save directories may contain save games, so stale files are only removed from the launcher
+    trees, and only from the directories of the games that were generated. Without NumPy no demo
+    stats are generated, so the ones from earlier runs are kept.
+    """
+    keep_extensions = ['.json'] if np is None else []
+    tree_sync = TreeSync()
+    for game in games:
+        for name in doom_config.get_output_path_names():
+            tree_sync.add_tree(
+                os.path.join(getattr(staging_config, name), game.get_directory_friendly_name()),
+                os.path.join(getattr(doom_config, name), game.get_directory_friendly_name()),
+                delete_stale=name != 'unix_saves_path',
+                keep_extensions=keep_extensions if name == 'unix_demo_launchers_path' else ())
+    result = tree_sync.sync()
+    staged_count = result.written + result.unchanged
+    print('Generated {0} files in staging in {1:.2f}s'.format(staged_count, generate_elapsed))
+    print('Synced in {0:.2f}s: {1} written, {2} unchanged, {3} deleted'.format(
+        result.elapsed, result.written, result.unchanged, result.deleted))
+    if staged_count:
+        write_cost = tree_sync.probe_write_cost(
+            doom_config.unix_launchers_path, result.staged_size // staged_count)
+        print('A probe write measured {0:.2f}ms per file, so writing all {1} files directly '
+              'would take about {2:.2f}s'.format(
+                  write_cost * 1000, staged_count, write_cost * staged_count))
+
 def main():
     doom_config = get_doom_config()
-    menu = CliMenu('./game-data', doom_config)
-    menu.display_source_ports()
-    games = menu.get_user_game_selection()
-    for game in games:
-        game.generate_launch_batch_files()
-        game.generate_d2all_record_batch_file()
-        game.generate_map_launch_batch_files()
-        game.create_demo_directories()
-        game.create_save_directories()
-        game.generate_demo_launchers()
-        game.generate_viddump_launchers()
+    staging_path = os.getenv('UNIX_DOOM_STAGING_PATH')
+    output_config = doom_config
+    if staging_path:
+        staging_path = tempfile.mkdtemp(prefix='doom-', dir=staging_path)
+        output_config = doom_config.get_staging_config(staging_path)
+    if np is None:
+        print('NumPy is not installed, so demo stats will not be generated')
+    try:
+        menu = CliMenu('./game-data', output_config)
+        menu.display_source_ports()
+        games = menu.get_user_game_selection()
+        start = time.perf_counter()
+        for game in games:
+            game.generate_launch_batch_files()
+            game.generate_d2all_record_batch_file()
+            game.generate_map_launch_batch_files()
+            game.create_demo_directories()
+            game.create_save_directories()
+            game.generate_demo_launchers()
+            game.generate_viddump_launchers()
+            game.generate_demo_stats()
+            game.generate_benchmark_batch_file()
+            game.generate_benchmark_report()
+        generate_elapsed = time.perf_counter() - start
+        if staging_path:
+            sync_staged_output(games, output_config, doom_config, generate_elapsed)
+        else:
+            print('Wrote launchers in {0:.2f}s'.format(generate_elapsed))
+    finally:
+        if staging_path:
+            shutil.rmtree(staging_path, ignore_errors=True)
 
 if __name__ == '__main__':
     sys.exit(main())